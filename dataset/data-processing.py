@@ -2,10 +2,27 @@ import pandas as pd
 import numpy as np
 import json
 import re
+import math
 import glob
 import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 
+# Use orjson for serializing the JSON columns when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Use the multithreaded Arrow CSV reader/writer when pyarrow is installed
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
 # Day name mapping
 DAY_MAPPING = {
     'Monday': 'mon',
@@ -17,26 +34,75 @@ DAY_MAPPING = {
     'Sunday': 'sun'
 }
 
+# Case-insensitive day name lookup
+_DAY_MAPPING_CI = {day.lower(): abbr for day, abbr in DAY_MAPPING.items()}
+
 ALL_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 ALL_DAYS_ABBR = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
 
+# Position of each day abbreviation, used as a sort key
+_DAY_ORDER = {abbr: i for i, abbr in enumerate(ALL_DAYS_ABBR)}
+
 # Short forms that should remain uppercase
 SHORT_FORMS = {'AU2', 'ASSB', 'KT', 'KB', 'LRT', 'MDDM', 'FAMA', 'JPS', 'UTC'}
 
+# Serialized schedule for markets without opening hours
+EMPTY_SCHEDULE = '[]'
+
+# Values of is_temporarily_closed / is_permanently_closed that mean "not closed"
+FALSY_FLAGS = ['', 'false', '0', 'nan', 'none']
+
+# Time range like "6 pm-12 am" or "4:30-8:30 pm"
+# Pattern: (hour)(:minute)? (am|pm)? - (hour)(:minute)? (am|pm)?
+_TIME_RE = re.compile(
+    r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\s*-\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?',
+    re.IGNORECASE
+)
+
+
+def _finite_or_none(obj: Any) -> Any:
+    """
+    Replace NaN/Infinity floats in obj (recursively) with None.
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite_or_none(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite_or_none(value) for value in obj]
+    return obj
+
+
+def dumps_json(obj: Any) -> str:
+    """
+    Serialize obj to a compact JSON string.
+    NaN/Infinity become null (as orjson does), so output is the same whether
+    or not orjson is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    try:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        return json.dumps(_finite_or_none(obj), separators=(',', ':'), ensure_ascii=False)
+
 
 def clean_quotes(text: str) -> str:
     """
     Remove leading and trailing quotes from text.
     """
-    if pd.isna(text) or text == '':
+    # Values are usually already str, so only coerce (and check for NaN) otherwise
+    if type(text) is not str:
+        if pd.isna(text):
+            return text
+        text = str(text)
+    if text == '':
         return text
     
-    text = str(text).strip()
+    text = text.strip()
     
     # Remove leading and trailing quotes (both single and double)
-    if text.startswith('"') and text.endswith('"') and len(text) >= 2:
-        text = text[1:-1]
-    elif text.startswith("'") and text.endswith("'") and len(text) >= 2:
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in ('"', "'"):
         text = text[1:-1]
     
     return text
@@ -46,11 +112,11 @@ def title_case_with_exceptions(text: str) -> str:
     """
     Convert text to title case, but keep short forms in uppercase.
     """
-    if pd.isna(text) or text == '':
+    if (type(text) is not str and pd.isna(text)) or text == '':
         return text
     
-    text = clean_quotes(text)  # Clean quotes first
-    text = str(text).lower()
+    text = clean_quotes(text)  # Clean quotes first (also coerces to str)
+    text = text.lower()
     
     # Split into words
     words = text.split()
@@ -71,11 +137,27 @@ def parse_time_range(time_str: str) -> Optional[Dict[str, str]]:
     """
     Parse time string like "6 pm-12 am" or "4:30-8:30 pm" to {"start": "18:00", "end": "00:00"}
     Handles various formats including "Open 24 hours" and "Closed"
+    Results are cached (markets share a small set of time strings), so the
+    returned dict must not be mutated.
+    """
+    if type(time_str) is not str:
+        if pd.isna(time_str):
+            return None
+        time_str = str(time_str)
+    
+    # Only str values reach the cache, so unhashable input (e.g. a dict) is still handled
+    return _parse_time_range_str(time_str)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_time_range_str(time_str: str) -> Optional[Dict[str, str]]:
+    """
+    Cached body of parse_time_range for str input.
     """
-    if pd.isna(time_str) or time_str == '':
+    if time_str == '':
         return None
     
-    time_str = str(time_str).strip()
+    time_str = time_str.strip()
     
     # Handle special cases
     if 'Open 24 hours' in time_str or '24 hours' in time_str:
@@ -85,9 +167,7 @@ def parse_time_range(time_str: str) -> Optional[Dict[str, str]]:
         return None  # Skip closed days
     
     # Parse time range like "6 pm-12 am" or "4:30-8:30 pm"
-    # Pattern: (hour)(:minute)? (am|pm)? - (hour)(:minute)? (am|pm)?
-    pattern = r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\s*-\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?'
-    match = re.search(pattern, time_str, re.IGNORECASE)
+    match = _TIME_RE.search(time_str)
     
     if not match:
         return None
@@ -164,7 +244,7 @@ def transform_hours_to_schedule(hours_str: str) -> List[Dict[str, Any]]:
             continue  # Skip closed days
         
         # Create a key for grouping (same times = same schedule entry)
-        time_key = json.dumps(time_obj, sort_keys=True)
+        time_key = (time_obj['start'], time_obj['end'], time_obj.get('note'))
         
         if time_key not in schedule_map:
             schedule_map[time_key] = {
@@ -173,21 +253,23 @@ def transform_hours_to_schedule(hours_str: str) -> List[Dict[str, Any]]:
             }
         
         # Convert day name to abbreviation
-        day_abbr = DAY_MAPPING.get(day_name, day_name.lower()[:3])
+        day_abbr = DAY_MAPPING.get(day_name)
+        if day_abbr is None:
+            day_abbr = _DAY_MAPPING_CI.get(day_name.lower(), day_name.lower()[:3])
         schedule_map[time_key]['days'].append(day_abbr)
     
     # Convert to final format and sort days
     schedule = []
     for time_key, data in schedule_map.items():
         # Sort days in order
-        sorted_days = sorted(data['days'], key=lambda x: ALL_DAYS_ABBR.index(x) if x in ALL_DAYS_ABBR else 999)
+        sorted_days = sorted(data['days'], key=lambda x: _DAY_ORDER.get(x, 999))
         schedule.append({
             'days': sorted_days,
             'times': data['times']
         })
     
     # Sort schedule entries by first day
-    schedule.sort(key=lambda x: ALL_DAYS_ABBR.index(x['days'][0]) if x['days'] and x['days'][0] in ALL_DAYS_ABBR else 999)
+    schedule.sort(key=lambda x: _DAY_ORDER.get(x['days'][0], 999) if x['days'] else 999)
     
     return schedule
 
@@ -199,10 +281,14 @@ def transform_closed_on_to_opening_day(closed_on_str: str) -> List[str]:
     - JSON array like ["Monday","Tuesday"] → remaining days
     - empty/null → all 7 days
     """
-    if pd.isna(closed_on_str) or closed_on_str == '':
+    if type(closed_on_str) is not str:
+        if pd.isna(closed_on_str):
+            return ALL_DAYS_ABBR.copy()
+        closed_on_str = str(closed_on_str)
+    if closed_on_str == '':
         return ALL_DAYS_ABBR.copy()
     
-    closed_on_str = str(closed_on_str).strip()
+    closed_on_str = closed_on_str.strip()
     
     if closed_on_str == 'Open All Days':
         return ALL_DAYS_ABBR.copy()
@@ -211,8 +297,8 @@ def transform_closed_on_to_opening_day(closed_on_str: str) -> List[str]:
     try:
         closed_days = json.loads(closed_on_str) if isinstance(closed_on_str, str) else closed_on_str
         if isinstance(closed_days, list):
-            # Convert closed days to abbreviations
-            closed_abbr = [DAY_MAPPING.get(day, day.lower()[:3]) for day in closed_days if day in DAY_MAPPING]
+            # Convert closed days to abbreviations (unknown names map to None and are ignored)
+            closed_abbr = {_DAY_MAPPING_CI.get(str(day).strip().lower()) for day in closed_days}
             # Return remaining days
             opening_days = [day for day in ALL_DAYS_ABBR if day not in closed_abbr]
             return opening_days if opening_days else ALL_DAYS_ABBR.copy()
@@ -223,6 +309,15 @@ def transform_closed_on_to_opening_day(closed_on_str: str) -> List[str]:
     return ALL_DAYS_ABBR.copy()
 
 
+@functools.lru_cache(maxsize=128)
+def opening_days_json(days: tuple) -> str:
+    """
+    Serialize a tuple of opening days to a JSON array string.
+    There are at most 2^7 distinct day sets, so each is serialized only once.
+    """
+    return dumps_json(list(days))
+
+
 def parse_coordinates(coord_str: str) -> Optional[Dict[str, float]]:
     """
     Parse coordinates JSON string to dict format.
@@ -245,33 +340,111 @@ def parse_coordinates(coord_str: str) -> Optional[Dict[str, float]]:
     return None
 
 
+def map_unique(series: pd.Series, func) -> pd.Series:
+    """
+    Apply func once per distinct non-null value and map the results back to every row.
+    Null values stay null.
+    """
+    return series.map({value: func(value) for value in series.dropna().unique()})
+
+
 def create_location_jsonb(latitude: float, longitude: float, gmaps_link: str) -> str:
     """
     Create location JSONB combining latitude, longitude, and gmaps_link.
+    Latitude and longitude are floats, with NaN for missing values.
     """
     location = {
-        "latitude": float(latitude) if not pd.isna(latitude) else None,
-        "longitude": float(longitude) if not pd.isna(longitude) else None,
+        # NaN is the only value not equal to itself
+        "latitude": float(latitude) if latitude == latitude else None,
+        "longitude": float(longitude) if longitude == longitude else None,
         "gmaps_link": str(gmaps_link) if not pd.isna(gmaps_link) else ""
     }
-    return json.dumps(location)
+    return dumps_json(location)
+
+
+# Columns to remove
+# Most are skipped at read time; the closed flags are kept until rows have been filtered
+columns_to_remove = [
+    'place_id', 'description', 'is_spending_on_ads', 'reviews', 'rating', 'competitors',
+    'website', 'phone', 'can_claim', 'owner', 'owner_posts', 'featured_image',
+    'main_category', 'categories', 'status', 'is_temporarily_closed', 'is_permanently_closed',
+    'price_range', 'reviews_per_rating', 'reviews_link', 'plus_code', 'detailed_address',
+    'time_zone', 'cid', 'data_id', 'kgmid', 'about', 'most_popular_times', 'popular_times',
+    'menu', 'reservations', 'order_online_links', 'image_count', 'images', 'featured_images',
+    'on_site_places', 'customer_updates', 'featured_question', 'review_keywords',
+    'featured_reviews', 'detailed_reviews', 'query'
+]
+
+closed_flag_columns = ['is_temporarily_closed', 'is_permanently_closed']
+
+# Removed columns that load_csv skipped, across all files (for the summary log)
+skipped_columns = set()
+
+
+def keep_column(col: str) -> bool:
+    """
+    usecols filter for read_csv: skip removed columns except the closed flags.
+    """
+    return col not in columns_to_remove or col in closed_flag_columns
+
+
+def flag_to_bool(series: pd.Series) -> pd.Series:
+    """
+    Convert a closed flag column to booleans.
+    Null, empty, "false", "0", "nan" and "none" are False; anything else is True.
+    """
+    flag = series.astype('string').str.strip().str.lower()
+    return ~(flag.isna() | flag.isin(FALSY_FLAGS))
+
+
+def load_csv(csv_file: str) -> Optional[pd.DataFrame]:
+    """
+    Load a raw CSV file with only the columns we keep.
+    Returns None if the file cannot be loaded.
+    """
+    try:
+        header = pd.read_csv(csv_file, nrows=0).columns
+        columns = [col for col in header if keep_column(col)]
+        skipped_columns.update(col for col in header if not keep_column(col))
+        df = None
+        if HAS_PYARROW:
+            # Some quoted values (descriptions, addresses) contain newlines, which
+            # Arrow only handles correctly with newlines_in_values enabled
+            try:
+                df = pa_csv.read_csv(
+                    csv_file,
+                    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                    convert_options=pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True)
+                ).to_pandas()
+            except pa.ArrowException as e:
+                print(f"pyarrow could not read {csv_file} ({e}), retrying with the C parser")
+        if df is None:
+            df = pd.read_csv(csv_file, usecols=columns)
+    except Exception as e:
+        print(f"Error loading {csv_file}: {e}")
+        return None
+    
+    # Store the closed flags as booleans so filtering is a plain mask
+    for flag_col in closed_flag_columns:
+        if flag_col in df.columns:
+            df[flag_col] = flag_to_bool(df[flag_col])
+    
+    return df
 
 
 # Load all CSV files matching the pattern
 # Try both relative paths (if run from root) and current directory (if run from dataset/)
-csv_files = glob.glob('dataset/pasar-malam-in-*.csv') + glob.glob('pasar-malam-in-*.csv')
-csv_files = list(set(csv_files))  # Remove duplicates
+csv_files = sorted(glob.glob('dataset/pasar-malam-in-*.csv')) + sorted(glob.glob('pasar-malam-in-*.csv'))
+csv_files = list(dict.fromkeys(csv_files))  # Remove duplicates, keeping a stable order
 print(f"Found {len(csv_files)} CSV files to process")
 
-# Load all dataframes
+# Load all dataframes in parallel (read_csv releases the GIL while parsing)
 dataframes = []
-for csv_file in csv_files:
-    try:
-        df = pd.read_csv(csv_file)
-        dataframes.append(df)
-        print(f"Loaded {csv_file}: {len(df)} rows")
-    except Exception as e:
-        print(f"Error loading {csv_file}: {e}")
+with ThreadPoolExecutor(max_workers=max(1, min(8, len(csv_files)))) as executor:
+    for csv_file, df in zip(csv_files, executor.map(load_csv, csv_files)):
+        if df is not None:
+            dataframes.append(df)
+            print(f"Loaded {csv_file}: {len(df)} rows")
 
 if not dataframes:
     print("No dataframes loaded. Exiting.")
@@ -281,35 +454,15 @@ if not dataframes:
 df = pd.concat(dataframes, ignore_index=True)
 print(f"\nTotal rows after merge: {len(df)}")
 
-# Columns to remove
-columns_to_remove = [
-    'place_id', 'description', 'is_spending_on_ads', 'reviews', 'rating', 'competitors',
-    'website', 'phone', 'can_claim', 'owner', 'owner_posts', 'featured_image',
-    'main_category', 'categories', 'status', 'is_temporarily_closed', 'is_permanently_closed',
-    'price_range', 'reviews_per_rating', 'reviews_link', 'plus_code', 'detailed_address',
-    'time_zone', 'cid', 'data_id', 'kgmid', 'about', 'most_popular_times', 'popular_times',
-    'menu', 'reservations', 'order_online_links', 'image_count', 'images', 'featured_images',
-    'on_site_places', 'customer_updates', 'featured_question', 'review_keywords',
-    'featured_reviews', 'detailed_reviews', 'query'
-]
-
 # Filter rows before removing columns (we need is_temporarily_closed and is_permanently_closed for filtering)
 print("\nFiltering rows...")
 initial_count = len(df)
 
 # Filter out rows where is_temporarily_closed or is_permanently_closed have truthy values
-if 'is_temporarily_closed' in df.columns:
-    # Remove rows where value is truthy (non-empty, non-null, not "false", not "0")
-    mask_temp = df['is_temporarily_closed'].apply(
-        lambda x: pd.isna(x) or str(x).strip().lower() in ['', 'false', '0', 'nan', 'none']
-    )
-    df = df[mask_temp]
-
-if 'is_permanently_closed' in df.columns:
-    mask_perm = df['is_permanently_closed'].apply(
-        lambda x: pd.isna(x) or str(x).strip().lower() in ['', 'false', '0', 'nan', 'none']
-    )
-    df = df[mask_perm]
+for flag_col in closed_flag_columns:
+    if flag_col in df.columns:
+        # Missing when a file lacks the column, which counts as not closed
+        df = df[~df[flag_col].eq(True)]
 
 filtered_count = len(df)
 print(f"Filtered out {initial_count - filtered_count} rows (temporarily/permanently closed)")
@@ -317,16 +470,17 @@ print(f"Filtered out {initial_count - filtered_count} rows (temporarily/permanen
 # Remove columns (only if they exist)
 columns_to_remove_existing = [col for col in columns_to_remove if col in df.columns]
 df = df.drop(columns=columns_to_remove_existing, errors='ignore')
-print(f"Removed {len(columns_to_remove_existing)} columns")
+print(f"Removed {len(skipped_columns) + len(columns_to_remove_existing)} columns "
+      f"({len(skipped_columns)} skipped at read time)")
 
 # Apply quote cleaning and title case to name and address columns
 if 'name' in df.columns:
     print("\nCleaning quotes and applying title case to 'name' column...")
-    df['name'] = df['name'].apply(title_case_with_exceptions)
+    df['name'] = df['name'].map(title_case_with_exceptions)
 
 if 'address' in df.columns:
     print("Applying title case to 'address' column...")
-    df['address'] = df['address'].apply(title_case_with_exceptions)
+    df['address'] = df['address'].map(title_case_with_exceptions)
 
 # Rename columns
 rename_map = {}
@@ -342,36 +496,40 @@ if rename_map:
 # Transform closed_on to opening_day
 if 'closed_on' in df.columns:
     print("\nTransforming closed_on to opening_day...")
-    df['opening_day'] = df['closed_on'].apply(transform_closed_on_to_opening_day)
-    # Convert to JSON string for storage
-    df['opening_day'] = df['opening_day'].apply(lambda x: json.dumps(x) if isinstance(x, list) else json.dumps([]))
+    # Transform and convert to JSON string once per distinct closed_on value
+    df['opening_day'] = map_unique(
+        df['closed_on'],
+        lambda x: opening_days_json(tuple(transform_closed_on_to_opening_day(x)))
+    ).fillna(opening_days_json(tuple(ALL_DAYS_ABBR)))
     df = df.drop(columns=['closed_on'], errors='ignore')
     print("Transformed closed_on to opening_day")
 
 # Transform coordinates
 if 'coordinates' in df.columns:
     print("\nTransforming coordinates...")
-    df['coordinates_jsonb'] = df['coordinates'].apply(
-        lambda x: json.dumps(parse_coordinates(x)) if parse_coordinates(x) else None
-    )
+    # Parse each distinct coordinate string once and derive all columns from it
+    coords_data = map_unique(df['coordinates'], parse_coordinates)
+    df['coordinates_jsonb'] = coords_data.map(lambda x: dumps_json(x) if isinstance(x, dict) else None)
     # Extract latitude and longitude for location JSONB
-    coords_data = df['coordinates'].apply(parse_coordinates)
-    df['_latitude'] = coords_data.apply(lambda x: x['latitude'] if x and 'latitude' in x else None)
-    df['_longitude'] = coords_data.apply(lambda x: x['longitude'] if x and 'longitude' in x else None)
+    df['_latitude'] = coords_data.map(lambda x: x['latitude'] if isinstance(x, dict) else None)
+    df['_longitude'] = coords_data.map(lambda x: x['longitude'] if isinstance(x, dict) else None)
+    # Cast once so missing coordinates are NaN floats rather than None
+    df['_latitude'] = pd.to_numeric(df['_latitude'])
+    df['_longitude'] = pd.to_numeric(df['_longitude'])
     df = df.drop(columns=['coordinates'], errors='ignore')
     print("Transformed coordinates to JSONB format")
 
 # Create location JSONB
 if 'gmaps_link' in df.columns and '_latitude' in df.columns and '_longitude' in df.columns:
     print("\nCreating location JSONB...")
-    df['location'] = df.apply(
-        lambda row: create_location_jsonb(
-            row['_latitude'],
-            row['_longitude'],
-            row['gmaps_link']
-        ),
-        axis=1
-    )
+    df['location'] = [
+        create_location_jsonb(latitude, longitude, gmaps_link)
+        for latitude, longitude, gmaps_link in zip(
+            df['_latitude'].to_numpy(),
+            df['_longitude'].to_numpy(),
+            df['gmaps_link'].to_numpy()
+        )
+    ]
     # Remove temporary columns
     df = df.drop(columns=['_latitude', '_longitude', 'coordinates_jsonb'], errors='ignore')
     print("Created location JSONB")
@@ -379,9 +537,11 @@ if 'gmaps_link' in df.columns and '_latitude' in df.columns and '_longitude' in
 # Transform hours to schedule
 if 'hours' in df.columns:
     print("\nTransforming hours to schedule...")
-    df['schedule'] = df['hours'].apply(
-        lambda x: json.dumps(transform_hours_to_schedule(x)) if not pd.isna(x) else json.dumps([])
-    )
+    # Transform once per distinct hours value; rows without hours get the empty schedule
+    df['schedule'] = map_unique(
+        df['hours'],
+        lambda x: dumps_json(transform_hours_to_schedule(x))
+    ).fillna(EMPTY_SCHEDULE)
     df = df.drop(columns=['hours'], errors='ignore')
     print("Transformed hours to schedule format")
 
@@ -392,7 +552,17 @@ if os.path.exists('dataset'):
 else:
     output_file = 'processed-markets.csv'
 print(f"\nSaving to {output_file}...")
-df.to_csv(output_file, index=False)
+saved = False
+if HAS_PYARROW:
+    # Arrow quotes every string field and the header; pandas reads both formats the same
+    try:
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), output_file)
+        saved = True
+    except pa.ArrowException as e:
+        # e.g. an object column mixing ints and strs from different files
+        print(f"pyarrow could not write {output_file} ({e}), writing with pandas instead")
+if not saved:
+    df.to_csv(output_file, index=False)
 print(f"Saved {len(df)} rows to {output_file}")
 print(f"\nFinal columns: {list(df.columns)}")
 print("\nProcessing complete!")
\ No newline at end of file